@@ -1,56 +1,81 @@
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 import os
+import logging
 from dotenv import load_dotenv
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
+import asyncio
+import hashlib
+import json
+import threading
 import time
+from collections import OrderedDict
 from pathlib import Path
 from .constants import *
+from files.file_utils import write_file_atomic
 from models import ChatMessage, VideoPlan, VideoCode
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 openai_api_key = os.getenv("OPENAI_API_KEY")
 if not openai_api_key:
-    print("=== WARNING: No OPENAI_API_KEY found in environment variables ===")
+    logger.warning("No OPENAI_API_KEY found in environment variables")
     client = None
+    async_client = None
 else:
     client = OpenAI(api_key=openai_api_key)
+    # Async client for calls made from the event loop, so concurrent requests don't each hold a thread
+    async_client = AsyncOpenAI(api_key=openai_api_key)
 
 MAX_RETRIES = 2
 RETRY_DELAY = 0.2
+VIDEO_PLAN_CACHE_SIZE = 128
+# Cap concurrent TTS requests across all jobs to stay clear of the API's rate limits
+TTS_SEMAPHORE = asyncio.Semaphore(8)
+VIDEO_PLAN_CACHE_DIR = Path(os.getenv("VIDEO_PLAN_CACHE_DIR", "cache/video_plans"))
+VIDEO_PLAN_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+# Cached plans expire after this long, and only the most recent VIDEO_PLAN_CACHE_MAX_FILES are kept on disk
+VIDEO_PLAN_CACHE_MAX_AGE_SECONDS = int(os.getenv("VIDEO_PLAN_CACHE_MAX_AGE_SECONDS", 7 * 24 * 60 * 60))
+VIDEO_PLAN_CACHE_MAX_FILES = int(os.getenv("VIDEO_PLAN_CACHE_MAX_FILES", 1000))
+
+# LRU cache of generated video plans (JSON) and when they were generated, keyed by a hash of the
+# model, prompt and conversation. Backed by content-addressed files in VIDEO_PLAN_CACHE_DIR so plans
+# survive restarts and are shared by workers.
+video_plan_cache: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+# Plans are generated from worker threads, so cache updates are serialized
+video_plan_cache_lock = threading.Lock()
 
 async def generate_speech(text: str, output_path: Path) -> bool:
     """
     Generate speech from text using OpenAI's TTS API.
     Returns True if successful, False if failed.
     """
-    if client is None:
+    if async_client is None:
         raise Exception("OpenAI client not initialized")
 
     for attempt in range(MAX_RETRIES):
         try:
             if attempt > 0:
-                time.sleep(RETRY_DELAY)
+                await asyncio.sleep(RETRY_DELAY)
 
-            response = client.audio.speech.create(
-                model="tts-1",
-                voice="alloy",
-                input=text
-            )
+            async with TTS_SEMAPHORE:
+                response = await async_client.audio.speech.create(
+                    model="tts-1",
+                    voice="alloy",
+                    input=text
+                )
             
-            # Handle potential file I/O errors when writing the audio chunks
+            # Handle potential file I/O errors when writing the audio
             try:
-                with open(output_path, 'wb') as f:
-                    for chunk in response.iter_bytes():
-                        f.write(chunk)
+                await asyncio.to_thread(output_path.write_bytes, response.content)
                 return True
             except IOError as e:
-                print(f"=== ERROR: Failed to write audio file: {e} ===")
+                logger.error("Failed to write audio file: %s", e)
                 return False
 
         except Exception as e:
-            print(f"=== ERROR: Speech synthesis attempt {attempt + 1} failed: {e} ===")
-            print(f"=== ERROR: Exception type: {type(e)} ===")
+            logger.error("Speech synthesis attempt %d failed (%s): %s", attempt + 1, type(e).__name__, e)
             if attempt == MAX_RETRIES - 1:  # Last attempt
                 return False
 
@@ -68,8 +93,15 @@ def generate_video_plan(messages: List[ChatMessage]) -> Dict[str, ChatMessage]:
     Returns:
         Dict containing the assistant's response message with the JSON-formatted video plan.
     """
-    print(f"=== DEBUG: Starting generate_video_plan with {len(messages)} messages ===")
-    print(f"=== DEBUG: User query: {messages[0]['content']} ===")
+    logger.debug("Starting generate_video_plan with %d messages", len(messages))
+    logger.debug("User query: %s", messages[0]['content'])
+    
+    # Plans are generated at temperature 0, so an identical conversation can reuse a previous plan
+    cache_key = get_video_plan_cache_key(messages)
+    cached_plan = load_cached_video_plan(cache_key)
+    if cached_plan is not None:
+        logger.debug("Using cached video plan")
+        return {"message": {"role": "assistant", "content": cached_plan}}
     
     if client is None:
         raise Exception("OpenAI client not initialized")
@@ -79,7 +111,7 @@ def generate_video_plan(messages: List[ChatMessage]) -> Dict[str, ChatMessage]:
     api_messages = [{"role": "developer", "content": formatted_prompt}, *messages]
 
     try:
-        print("=== DEBUG: Calling OpenAI API for structured video plan ===")
+        logger.debug("Calling OpenAI API for structured video plan")
         completion = client.beta.chat.completions.parse(
             model=GPT_4O,
             messages=api_messages,
@@ -90,12 +122,83 @@ def generate_video_plan(messages: List[ChatMessage]) -> Dict[str, ChatMessage]:
         video_plan = completion.choices[0].message.parsed
         json_response = video_plan.model_dump_json(indent=2)
         
+        store_video_plan(cache_key, json_response)
+        
         return {"message": {"role": "assistant", "content": json_response}}
 
     except Exception as e:
-        print(f"=== ERROR: Exception when calling OpenAI API: {e} ===")
+        logger.exception("Exception when calling OpenAI API: %s", e)
         raise Exception(f"Failed to generate response: {str(e)}")
 
+def get_video_plan_cache_key(messages: List[ChatMessage]) -> str:
+    """
+    Build a compact cache key for a conversation by hashing its roles and contents, along with the
+    model and prompt, so plans from a previous model or prompt are never served.
+    """
+    conversation = json.dumps([
+        GPT_4O,
+        VIDEO_PLAN_PROMPT,
+        [[message['role'], message['content']] for message in messages]
+    ])
+    return hashlib.blake2b(conversation.encode("utf-8"), digest_size=16).hexdigest()
+
+def remember_video_plan(cache_key: str, json_content: str, created_at: float):
+    with video_plan_cache_lock:
+        video_plan_cache[cache_key] = (json_content, created_at)
+        video_plan_cache.move_to_end(cache_key)
+        if len(video_plan_cache) > VIDEO_PLAN_CACHE_SIZE:
+            video_plan_cache.popitem(last=False)
+
+def load_cached_video_plan(cache_key: str) -> Optional[str]:
+    """
+    Look up an unexpired cached video plan in memory, then on disk. Returns None on a miss.
+    """
+    cached = video_plan_cache.get(cache_key)
+    if cached is None:
+        cache_path = VIDEO_PLAN_CACHE_DIR / f"{cache_key}.json"
+        try:
+            created_at = cache_path.stat().st_mtime
+            cached = (cache_path.read_text(), created_at)
+        except OSError:
+            return None
+    json_content, created_at = cached
+    if time.time() - created_at > VIDEO_PLAN_CACHE_MAX_AGE_SECONDS:
+        return None
+    remember_video_plan(cache_key, json_content, created_at)
+    return json_content
+
+def store_video_plan(cache_key: str, json_content: str):
+    """
+    Cache a video plan in memory and on disk, then prune the cache directory.
+    """
+    remember_video_plan(cache_key, json_content, time.time())
+    try:
+        write_file_atomic(VIDEO_PLAN_CACHE_DIR / f"{cache_key}.json", json_content.encode("utf-8"))
+        prune_video_plan_cache()
+    except OSError as e:
+        logger.warning("Failed to write video plan cache file: %s", e)
+
+def prune_video_plan_cache():
+    """
+    Delete cached plans older than VIDEO_PLAN_CACHE_MAX_AGE_SECONDS, and the oldest ones beyond
+    VIDEO_PLAN_CACHE_MAX_FILES. Runs only after a plan was generated, which is far slower than the scan.
+    """
+    entries = []
+    for entry in os.scandir(VIDEO_PLAN_CACHE_DIR):
+        try:
+            entries.append((entry.stat().st_mtime, entry.path))
+        except FileNotFoundError:
+            continue
+    entries.sort(reverse=True)
+
+    expires_before = time.time() - VIDEO_PLAN_CACHE_MAX_AGE_SECONDS
+    for index, (mtime, path) in enumerate(entries):
+        if mtime < expires_before or index >= VIDEO_PLAN_CACHE_MAX_FILES:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
 def generate_manim_scenes(video_plan: VideoPlan) -> VideoCode:
     """
     Generate Manim code for each scene in the video plan using OpenAI's chat completion API.
@@ -124,7 +227,7 @@ def generate_manim_scenes(video_plan: VideoPlan) -> VideoCode:
         return completion.choices[0].message.parsed
     
     except Exception as e:
-        print(f"=== ERROR: Exception when calling OpenAI API for Manim code generation: {e} ===")
+        logger.exception("Exception when calling OpenAI API for Manim code generation: %s", e)
         raise Exception(f"Failed to generate Manim scenes: {str(e)}")
 
 def retry_manim_scene_generation(scene_code: str, error_message: str) -> str:
@@ -158,6 +261,6 @@ def retry_manim_scene_generation(scene_code: str, error_message: str) -> str:
         return response.choices[0].message.content
 
     except Exception as e:
-        print(f"=== ERROR: Exception when calling OpenAI API for Manim error fix: {e} ===")
+        logger.exception("Exception when calling OpenAI API for Manim error fix: %s", e)
         return ""
 
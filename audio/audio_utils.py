@@ -1,12 +1,16 @@
 from fastapi import UploadFile
 from typing import Optional, Tuple, List
 from pathlib import Path
-import tempfile
 import mutagen
-import shutil
+from mutagen.mp3 import MP3
+import asyncio
+import logging
+import os
 from ai.ai_utils import generate_speech
 from models import AudioFile
 
+logger = logging.getLogger(__name__)
+
 # Constants
 MAX_AUDIO_SIZE_BYTES = 10 * 1024 * 1024  # 10MB
 ALLOWED_AUDIO_TYPES = {'audio/mpeg', 'audio/mp3'}
@@ -22,6 +26,9 @@ def get_audio_duration(file_path: str) -> float:
         float: Duration in seconds, or 5.0 if duration cannot be determined
     """
     try:
+        # Generated narration is always MP3; skip mutagen.File's probing of every format
+        if file_path.lower().endswith(".mp3"):
+            return float(MP3(file_path).info.length)
         audio = mutagen.File(file_path)
         if audio is None:
             return 5.0  # Default duration if file can't be read
@@ -45,30 +52,16 @@ def validate_audio_file(file: UploadFile) -> Tuple[bool, Optional[str]]:
         if file.content_type not in ALLOWED_AUDIO_TYPES:
             return False, f"Invalid audio format. Allowed types: {', '.join(ALLOWED_AUDIO_TYPES)}"
         
-        # Check file size using chunks to avoid loading entire file
-        total_size = 0
-        chunk_size = 8192  # 8KB chunks
-        
-        while True:
-            chunk = file.file.read(chunk_size)
-            if not chunk:
-                break
-            total_size += len(chunk)
-            if total_size > MAX_AUDIO_SIZE_BYTES:
-                file.file.seek(0)
-                return False, f"Audio file too large. Maximum size: {MAX_AUDIO_SIZE_BYTES/1024/1024}MB"
-        
-        file.file.seek(0)  # Reset file pointer
-        
-        # Stream to temporary file for format validation
-        with tempfile.NamedTemporaryFile(suffix='.mp3', delete=False) as temp_file:
-            file.file.seek(0)
-            shutil.copyfileobj(file.file, temp_file)
-            temp_path = temp_file.name
+        # Check file size from the end offset instead of reading the upload
+        file.file.seek(0, os.SEEK_END)
+        total_size = file.file.tell()
+        file.file.seek(0)
+        if total_size > MAX_AUDIO_SIZE_BYTES:
+            return False, f"Audio file too large. Maximum size: {MAX_AUDIO_SIZE_BYTES/1024/1024}MB"
         
         try:
-            # Validate audio file integrity
-            audio = mutagen.File(temp_path)
+            # Validate audio file integrity straight from the spooled upload
+            audio = mutagen.File(file.file)
             if audio is None:
                 return False, "Invalid audio file format or corrupted file"
             
@@ -79,44 +72,59 @@ def validate_audio_file(file: UploadFile) -> Tuple[bool, Optional[str]]:
                 
             return True, None
         finally:
-            Path(temp_path).unlink()
-            file.file.seek(0)  # Reset file pointer again
+            file.file.seek(0)  # Reset file pointer
             
     except Exception as e:
         return False, f"Error validating audio: {str(e)}"
 
+async def generate_scene_audio(audio_dir: Path, scene_idx: int, scene_content: str) -> AudioFile:
+    """
+    Generate the audio file for a single scene and return its path and duration.
+    
+    Args:
+        audio_dir: Directory where the audio file will be saved
+        scene_idx: Zero-based index of the scene
+        scene_content: Text content of the scene
+        
+    Returns:
+        AudioFile containing path and duration
+        
+    Raises:
+        Exception: If audio generation fails for the scene
+    """
+    audio_filename = f"scene_{scene_idx + 1}.mp3"
+    audio_path = audio_dir / audio_filename
+    
+    try:
+        success = await generate_speech(scene_content, audio_path)
+        if not success:
+            raise Exception(f"Failed to generate audio for scene {scene_idx + 1}")
+        duration = await asyncio.to_thread(get_audio_duration, str(audio_path))
+        logger.debug("Generated audio file: %s with duration %ss", audio_filename, duration)
+        return AudioFile(
+            path=str(audio_path),
+            duration=duration
+        )
+    except Exception as e:
+        logger.error("Audio generation failed for scene %d: %s", scene_idx + 1, e)
+        raise
+
 async def generate_audio(audio_dir: Path, script_contents: List[str]) -> List[AudioFile]:
     """
-    Generate audio files for each scene and return their paths and durations.
+    Generate audio files for each scene concurrently and return their paths and durations.
     
     Args:
         audio_dir: Directory where audio files will be saved
         script_contents: List of scene text content
         
     Returns:
-        List of AudioFile objects containing path and duration
+        List of AudioFile objects containing path and duration, in scene order
         
     Raises:
         Exception: If audio generation fails for any scene
     """
-    audio_files = []
-    for i, scene_content in enumerate(script_contents):
-        audio_filename = f"scene_{i + 1}.mp3"
-        audio_path = audio_dir / audio_filename
-        
-        try:
-            success = await generate_speech(scene_content, audio_path)
-            if success:
-                duration = get_audio_duration(str(audio_path))
-                audio_files.append(AudioFile(
-                    path=str(audio_path),
-                    duration=duration
-                ))
-                print(f"=== DEBUG: Generated audio file: {audio_filename} with duration {duration}s ===")
-            else:
-                raise Exception(f"Failed to generate audio for scene {i + 1}")
-        except Exception as e:
-            print(f"=== ERROR: Audio generation failed for scene {i + 1}: {str(e)} ===")
-            raise
-    
-    return audio_files
+    audio_files = await asyncio.gather(*(
+        generate_scene_audio(audio_dir, i, scene_content)
+        for i, scene_content in enumerate(script_contents)
+    ))
+    return list(audio_files)
@@ -0,0 +1,16 @@
+from pathlib import Path
+import os
+import threading
+
+def write_file_atomic(path: Path, content: bytes):
+    """
+    Write a file via a temporary sibling and os.replace, so readers never see a partial file.
+    The temporary name is unique per process and thread, so concurrent writers don't collide.
+    """
+    temp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        temp_path.write_bytes(content)
+        os.replace(temp_path, path)
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
@@ -0,0 +1,27 @@
+import multiprocessing
+import os
+
+# Job updates and the job queue only cross worker processes through Redis, so without it a
+# second worker would never see jobs running in the first. With Redis, each worker still runs
+# its own render process pool, so scale workers with cores more gently than the usual 2*CPU+1;
+# the workers split the host's cores between their render pools.
+REDIS_URL = os.getenv("REDIS_URL")
+DEFAULT_WORKERS = max(2, multiprocessing.cpu_count() // 4) if REDIS_URL else 1
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", DEFAULT_WORKERS))
+# Workers inherit this, so generation_utils sizes each render pool for its share of the cores
+os.environ["WEB_CONCURRENCY"] = str(workers)
+worker_class = "uvicorn.workers.UvicornWorker"
+# Heartbeat files on tmpfs, so a slow disk can't make the arbiter think a worker hung
+worker_tmp_dir = "/dev/shm"
+keepalive = 5
+loglevel = os.getenv("LOG_LEVEL", "debug")
+
+def on_starting(server):
+    if workers > 1 and not REDIS_URL:
+        server.log.warning(
+            "Running %d workers without REDIS_URL: each worker has its own job store events and "
+            "queue, so status streams and long-polls miss jobs running in other workers",
+            workers
+        )
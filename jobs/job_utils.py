@@ -0,0 +1,456 @@
+from pathlib import Path
+from typing import Optional, Dict, Set, List, Tuple, AsyncIterator, Awaitable, Callable
+import sqlite3
+import threading
+import time
+import asyncio
+import json
+import logging
+import os
+import socket
+from uuid import uuid4
+from dotenv import load_dotenv
+from redis.asyncio import Redis
+from models import JobStatus, JobMetadata
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Constants
+JOBS_DB_PATH = Path(os.getenv("JOBS_DB_PATH", "jobs.db"))
+# When set, job metadata lives in Redis so every API worker and host sees the same jobs
+REDIS_URL = os.getenv("REDIS_URL")
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", 24 * 60 * 60))
+FINISHED_JOB_STATUSES = {JobStatus.COMPLETED, JobStatus.FAILED}
+# How often the SQLite store drops jobs not updated within JOB_TTL_SECONDS, and finished jobs
+# beyond the JOB_STORE_MAX_JOBS most recently updated jobs
+JOB_SWEEP_INTERVAL_SECONDS = 60
+JOB_STORE_MAX_JOBS = int(os.getenv("JOB_STORE_MAX_JOBS", 10_000))
+# Number of video jobs run at once; further jobs wait in the queue
+JOB_WORKERS = max(1, int(os.getenv("JOB_WORKERS", "4")))
+# Pause before a worker retries after failing to take a job off the queue, e.g. while Redis is down
+JOB_DEQUEUE_RETRY_SECONDS = 1.0
+
+# Queues of stream subscribers for each job; every update is pushed to each of them.
+# Queues are bounded so a stalled client can't accumulate updates without limit.
+JOB_SUBSCRIBER_QUEUE_SIZE = 16
+job_subscribers: Dict[str, Set[asyncio.Queue]] = {}
+
+# Jobs waiting for a worker, as (job_id, user_query, is_pro). With Redis the queue is the
+# JOB_QUEUE_KEY list instead, so queued jobs survive restarts and any worker process can take them.
+JOB_QUEUE_KEY = "jobs:queue"
+job_queue: asyncio.Queue = asyncio.Queue()
+job_worker_tasks: List[asyncio.Task] = []
+
+# With Redis, a dequeued job moves atomically onto its process's processing list, and each process
+# holds a lease it renews while alive. When a process dies without finishing its jobs (OOM kill,
+# gunicorn's timeout SIGKILL), a live process finds its lease expired and fails the jobs it held.
+JOB_WORKERS_KEY = "jobs:workers"
+JOB_LEASE_SECONDS = 30
+JOB_HEARTBEAT_SECONDS = 10
+# Identifies this process's lease and processing list; set by start_job_workers
+job_worker_id: Optional[str] = None
+job_heartbeat_task: Optional[asyncio.Task] = None
+
+# Redis client, set by init_job_store when REDIS_URL is configured
+redis_client: Optional[Redis] = None
+
+# Periodic cleanup of expired SQLite jobs; Redis expires keys itself
+job_sweeper_task: Optional[asyncio.Task] = None
+
+# One connection per thread; WAL mode lets readers proceed while a writer is active
+thread_local = threading.local()
+
+def get_connection() -> sqlite3.Connection:
+    """
+    Return the calling thread's connection to the jobs database, opening it on first use.
+    """
+    connection = getattr(thread_local, "connection", None)
+    if connection is None:
+        connection = sqlite3.connect(JOBS_DB_PATH, isolation_level=None, timeout=5.0)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA synchronous=NORMAL")
+        thread_local.connection = connection
+    return connection
+
+def init_sqlite_job_store():
+    """
+    Create the jobs table and switch the database to WAL journaling.
+    """
+    connection = get_connection()
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute(
+        """
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            progress REAL NOT NULL DEFAULT 0,
+            video_url TEXT,
+            updated_at REAL NOT NULL DEFAULT 0
+        )
+        """
+    )
+    columns = {row["name"] for row in connection.execute("PRAGMA table_info(jobs)")}
+    if "updated_at" not in columns:
+        connection.execute("ALTER TABLE jobs ADD COLUMN updated_at REAL NOT NULL DEFAULT 0")
+    connection.execute("CREATE INDEX IF NOT EXISTS jobs_updated_at ON jobs (updated_at)")
+    # Without Redis the job queue lives in this process, so jobs left unfinished by the
+    # previous process can never run; fail them so their clients see a final state
+    finished = [status.value for status in FINISHED_JOB_STATUSES]
+    placeholders = ', '.join('?' * len(finished))
+    abandoned = connection.execute(
+        f"UPDATE jobs SET status = ?, progress = 0, updated_at = ? WHERE status NOT IN ({placeholders})",
+        (JobStatus.FAILED.value, time.time(), *finished)
+    ).rowcount
+    if abandoned:
+        logger.warning("Marked %d jobs left unfinished by a previous run as failed", abandoned)
+    logger.debug("Job store initialized at %s", JOBS_DB_PATH)
+
+def insert_job(job: JobMetadata):
+    get_connection().execute(
+        "INSERT INTO jobs (job_id, status, progress, video_url, updated_at) VALUES (?, ?, ?, ?, ?)",
+        (job.job_id, job.status.value, job.progress, job.videoUrl, time.time())
+    )
+
+def select_job(job_id: str) -> Optional[JobMetadata]:
+    row = get_connection().execute(
+        "SELECT job_id, status, progress, video_url FROM jobs WHERE job_id = ?",
+        (job_id,)
+    ).fetchone()
+    if row is None:
+        return None
+    # Rows are written only by this module, so skip pydantic validation
+    return JobMetadata.model_construct(
+        job_id=row["job_id"],
+        status=JobStatus(row["status"]),
+        progress=row["progress"],
+        videoUrl=row["video_url"]
+    )
+
+def update_job_row(job_id: str, status: JobStatus, progress: float, video_url: Optional[str]):
+    get_connection().execute(
+        "UPDATE jobs SET status = ?, progress = ?, video_url = COALESCE(?, video_url), updated_at = ? WHERE job_id = ?",
+        (status.value, progress, video_url, time.time(), job_id)
+    )
+
+def delete_expired_jobs() -> int:
+    """
+    Delete jobs not updated within JOB_TTL_SECONDS, as Redis expires them, and finished jobs
+    outside the JOB_STORE_MAX_JOBS most recently updated. Returns how many were removed.
+    """
+    finished = [status.value for status in FINISHED_JOB_STATUSES]
+    placeholders = ', '.join('?' * len(finished))
+    connection = get_connection()
+    expired = connection.execute(
+        "DELETE FROM jobs WHERE updated_at < ?",
+        (time.time() - JOB_TTL_SECONDS,)
+    ).rowcount
+    evicted = connection.execute(
+        f"""
+        DELETE FROM jobs WHERE status IN ({placeholders}) AND updated_at < (
+            SELECT updated_at FROM jobs ORDER BY updated_at DESC LIMIT 1 OFFSET ?
+        )
+        """,
+        (*finished, JOB_STORE_MAX_JOBS - 1)
+    ).rowcount
+    return expired + evicted
+
+async def sweep_expired_jobs():
+    """
+    Periodically delete expired jobs from the SQLite store until cancelled.
+    """
+    while True:
+        await asyncio.sleep(JOB_SWEEP_INTERVAL_SECONDS)
+        try:
+            deleted = await asyncio.to_thread(delete_expired_jobs)
+            if deleted:
+                logger.debug("Deleted %d expired jobs", deleted)
+        except sqlite3.Error as e:
+            logger.warning("Failed to delete expired jobs: %s", e)
+
+def get_job_key(job_id: str) -> str:
+    return f"job:{job_id}"
+
+def get_job_channel(job_id: str) -> str:
+    return f"job:{job_id}:events"
+
+def job_from_hash(job_id: str, fields: Dict[str, str]) -> JobMetadata:
+    return JobMetadata.model_construct(
+        job_id=job_id,
+        status=JobStatus(fields["status"]),
+        progress=float(fields["progress"]),
+        videoUrl=fields.get("videoUrl")
+    )
+
+async def init_job_store():
+    """
+    Connect to Redis if REDIS_URL is set, otherwise prepare the SQLite job store.
+    """
+    global redis_client, job_sweeper_task
+    if REDIS_URL:
+        redis_client = Redis.from_url(REDIS_URL, decode_responses=True)
+        await redis_client.ping()
+        logger.debug("Job store using Redis")
+    else:
+        await asyncio.to_thread(init_sqlite_job_store)
+        job_sweeper_task = asyncio.create_task(sweep_expired_jobs())
+
+async def close_job_store():
+    """
+    Stop the SQLite job sweeper and close the Redis connection pool, if one was opened.
+    """
+    global redis_client, job_sweeper_task
+    if job_sweeper_task is not None:
+        job_sweeper_task.cancel()
+        job_sweeper_task = None
+    if redis_client is not None:
+        await redis_client.aclose()
+        redis_client = None
+
+async def create_job(job_id: str) -> JobMetadata:
+    """
+    Persist a new pending job and return its metadata.
+    """
+    job = JobMetadata.model_construct(
+        job_id=job_id,
+        status=JobStatus.PENDING,
+        progress=0,
+        videoUrl=None
+    )
+    if redis_client is not None:
+        key = get_job_key(job_id)
+        async with redis_client.pipeline(transaction=True) as pipe:
+            pipe.hset(key, mapping={"status": job.status.value, "progress": job.progress})
+            pipe.expire(key, JOB_TTL_SECONDS)
+            await pipe.execute()
+    else:
+        await asyncio.to_thread(insert_job, job)
+    return job
+
+async def get_job(job_id: str) -> Optional[JobMetadata]:
+    """
+    Load a job's metadata, or None if the job does not exist.
+    """
+    if redis_client is not None:
+        fields = await redis_client.hgetall(get_job_key(job_id))
+        return job_from_hash(job_id, fields) if fields else None
+    return await asyncio.to_thread(select_job, job_id)
+
+async def update_job(
+    job_id: str,
+    status: JobStatus,
+    progress: float,
+    video_url: Optional[str] = None
+):
+    """
+    Update a job's status and progress, and its video URL when one is given.
+    In SQLite, updating a job that does not exist is a no-op; in Redis every update
+    also renews the job's TTL.
+    """
+    job = JobMetadata.model_construct(
+        job_id=job_id,
+        status=status,
+        progress=progress,
+        videoUrl=video_url
+    )
+    # Serialized once here and shared by every subscriber
+    payload = job.model_dump_json()
+    if redis_client is not None:
+        fields = {"status": status.value, "progress": progress}
+        if video_url is not None:
+            fields["videoUrl"] = video_url
+        key = get_job_key(job_id)
+        async with redis_client.pipeline(transaction=True) as pipe:
+            pipe.hset(key, mapping=fields)
+            pipe.expire(key, JOB_TTL_SECONDS)
+            pipe.publish(get_job_channel(job_id), payload)
+            await pipe.execute()
+    else:
+        await asyncio.to_thread(update_job_row, job_id, status, progress, video_url)
+    publish_job_update(job, payload)
+
+def publish_job_update(job: JobMetadata, payload: str):
+    """
+    Push a job snapshot and its JSON to every stream subscribed to the job.
+    """
+    for queue in job_subscribers.get(job.job_id, ()):
+        if queue.full():
+            # Each snapshot is a complete state, so a lagging stream only needs the newest ones
+            queue.get_nowait()
+        queue.put_nowait((job, payload))
+
+async def iter_job_updates(job_id: str) -> AsyncIterator[Tuple[JobMetadata, str]]:
+    """
+    Yield the job's current metadata, then every update, until the job finishes.
+    Each snapshot comes with its JSON, serialized once no matter how many streams receive it.
+    With Redis, updates arrive over pub/sub so any worker can stream any job.
+    """
+    if redis_client is not None:
+        async for update in iter_redis_job_updates(job_id):
+            yield update
+        return
+
+    queue = asyncio.Queue(maxsize=JOB_SUBSCRIBER_QUEUE_SIZE)
+    # Subscribe before reading the current state so no update falls in between
+    job_subscribers.setdefault(job_id, set()).add(queue)
+    try:
+        job = await get_job(job_id)
+        if job is None:
+            return
+        payload = job.model_dump_json()
+        while True:
+            yield job, payload
+            if job.status in FINISHED_JOB_STATUSES:
+                break
+            job, payload = await queue.get()
+    finally:
+        subscribers = job_subscribers.get(job_id)
+        if subscribers is not None:
+            subscribers.discard(queue)
+            if not subscribers:
+                del job_subscribers[job_id]
+
+async def iter_redis_job_updates(job_id: str) -> AsyncIterator[Tuple[JobMetadata, str]]:
+    pubsub = redis_client.pubsub()
+    # Subscribe before reading the current state so no update falls in between
+    await pubsub.subscribe(get_job_channel(job_id))
+    try:
+        job = await get_job(job_id)
+        if job is None:
+            return
+        payload = job.model_dump_json()
+        while True:
+            yield job, payload
+            if job.status in FINISHED_JOB_STATUSES:
+                break
+            message = None
+            while message is None:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=None)
+            payload = message["data"]
+            job = JobMetadata.model_validate_json(payload)
+    finally:
+        await pubsub.aclose()
+
+async def enqueue_job(job_id: str, user_query: str, is_pro: bool):
+    """
+    Queue a job for the next free worker.
+    """
+    if redis_client is not None:
+        await redis_client.lpush(JOB_QUEUE_KEY, json.dumps([job_id, user_query, is_pro]))
+    else:
+        job_queue.put_nowait((job_id, user_query, is_pro))
+
+def get_job_processing_key(worker_id: str) -> str:
+    return f"jobs:processing:{worker_id}"
+
+def get_job_lease_key(worker_id: str) -> str:
+    return f"jobs:lease:{worker_id}"
+
+async def dequeue_job() -> Tuple[Tuple[str, str, bool], Optional[str]]:
+    """
+    Wait for the next queued job. Returns the job and, with Redis, its queue entry,
+    which must be passed to acknowledge_job once the job has run.
+    """
+    if redis_client is not None:
+        payload = await redis_client.blmove(
+            JOB_QUEUE_KEY, get_job_processing_key(job_worker_id), timeout=0, src="RIGHT", dest="LEFT"
+        )
+        job_id, user_query, is_pro = json.loads(payload)
+        return (job_id, user_query, is_pro), payload
+    return await job_queue.get(), None
+
+async def acknowledge_job(payload: Optional[str]):
+    """
+    Remove a job that has run from this process's processing list.
+    """
+    if redis_client is not None and payload is not None:
+        await redis_client.lrem(get_job_processing_key(job_worker_id), 1, payload)
+
+async def run_job_worker(process_job: Callable[[str, str, bool], Awaitable[None]]):
+    """
+    Run queued jobs one after another until cancelled.
+    """
+    while True:
+        try:
+            (job_id, user_query, is_pro), payload = await dequeue_job()
+        except Exception:
+            logger.exception("Failed to take a job off the queue")
+            await asyncio.sleep(JOB_DEQUEUE_RETRY_SECONDS)
+            continue
+        try:
+            await process_job(job_id, user_query, is_pro)
+        except Exception:
+            # process_job has already logged the failure and marked the job as failed
+            pass
+        finally:
+            try:
+                await acknowledge_job(payload)
+            except Exception:
+                logger.exception("Failed to acknowledge job %s", job_id)
+
+async def fail_orphaned_jobs(worker_id: str):
+    """
+    Fail the unfinished jobs held by a process whose lease expired, then forget the process.
+    """
+    processing_key = get_job_processing_key(worker_id)
+    # Popped one at a time, so two processes reaping the same list never handle a job twice
+    while (payload := await redis_client.rpop(processing_key)) is not None:
+        job_id = json.loads(payload)[0]
+        job = await get_job(job_id)
+        if job is not None and job.status not in FINISHED_JOB_STATUSES:
+            logger.warning("Job %s was abandoned by worker %s; marking it as failed", job_id, worker_id)
+            await update_job(job_id, JobStatus.FAILED, 0)
+    await redis_client.srem(JOB_WORKERS_KEY, worker_id)
+
+async def renew_job_lease():
+    """
+    Renew this process's lease and reap the jobs of processes whose lease expired, until cancelled.
+    """
+    while True:
+        try:
+            await redis_client.set(get_job_lease_key(job_worker_id), 1, ex=JOB_LEASE_SECONDS)
+            await redis_client.sadd(JOB_WORKERS_KEY, job_worker_id)
+            for worker_id in await redis_client.smembers(JOB_WORKERS_KEY):
+                if worker_id != job_worker_id and not await redis_client.exists(get_job_lease_key(worker_id)):
+                    await fail_orphaned_jobs(worker_id)
+        except Exception:
+            logger.exception("Failed to renew the job worker lease")
+        await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+
+def start_job_workers(process_job: Callable[[str, str, bool], Awaitable[None]]):
+    """
+    Start JOB_WORKERS tasks that take jobs off the queue, and with Redis the lease heartbeat.
+    """
+    global job_worker_id, job_heartbeat_task
+    job_worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex}"
+    if redis_client is not None:
+        job_heartbeat_task = asyncio.create_task(renew_job_lease())
+    for _ in range(JOB_WORKERS):
+        job_worker_tasks.append(asyncio.create_task(run_job_worker(process_job)))
+    logger.debug("Started %d job workers", JOB_WORKERS)
+
+async def stop_job_workers():
+    """
+    Cancel the job workers and wait for them to exit. Cancelled jobs mark themselves as failed and
+    are acknowledged; with Redis, anything still on this process's processing list is requeued
+    before its lease is released.
+    """
+    global job_heartbeat_task
+    for task in job_worker_tasks:
+        task.cancel()
+    await asyncio.gather(*job_worker_tasks, return_exceptions=True)
+    job_worker_tasks.clear()
+    if job_heartbeat_task is not None:
+        job_heartbeat_task.cancel()
+        await asyncio.gather(job_heartbeat_task, return_exceptions=True)
+        job_heartbeat_task = None
+        try:
+            # A job moved off the queue just as its worker was cancelled never started; put it back
+            processing_key = get_job_processing_key(job_worker_id)
+            while await redis_client.lmove(processing_key, JOB_QUEUE_KEY, src="LEFT", dest="RIGHT") is not None:
+                pass
+            await redis_client.delete(get_job_lease_key(job_worker_id))
+            await redis_client.srem(JOB_WORKERS_KEY, job_worker_id)
+        except Exception:
+            logger.exception("Failed to release the job worker lease")
@@ -1,29 +1,75 @@
-from fastapi import FastAPI, HTTPException, UploadFile, BackgroundTasks, Body, Request, Response
+from fastapi import FastAPI, HTTPException, UploadFile, Body, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import FileResponse, ORJSONResponse, StreamingResponse
 from uuid import uuid4
-from typing import List, Dict
+from typing import List
 from pathlib import Path
-from manim import *
-from contextlib import asynccontextmanager
+from contextlib import AsyncExitStack, asynccontextmanager
+from functools import partial
+from logging.handlers import QueueHandler, QueueListener
 import asyncio
+import atexit
+import logging
+import multiprocessing
+import os
+import re
 from videos.generation.generation_utils import (
+    DEBUG_MODE,
     prepare_video_prerequisites,
-    generate_and_render_video
+    generate_and_render_video,
+    start_render_pool,
+    shutdown_render_pool
 )
 from videos.streaming.streaming_utils import (
     get_video_file_response,
-    read_video_chunk
+    get_accel_redirect_headers,
+    iter_video_chunks
+)
+from jobs.job_utils import (
+    init_job_store,
+    close_job_store,
+    create_job,
+    get_job,
+    update_job,
+    iter_job_updates,
+    enqueue_job,
+    start_job_workers,
+    stop_job_workers,
+    FINISHED_JOB_STATUSES
 )
 from models import JobStatus, JobMetadata, VideoRequest
 
-# In-memory job store
-jobs: Dict[str, JobMetadata] = {}
+# Log calls only enqueue records; a listener thread does the formatting and stderr writes.
+# A multiprocessing queue also carries records from the forked render workers.
+log_queue = multiprocessing.Queue(-1)
+log_handler = logging.StreamHandler()
+log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+log_listener = QueueListener(log_queue, log_handler)
+# QueueHandler bakes its formatted text into the record, so it must add no prefix of its own
+queue_handler = QueueHandler(log_queue)
+queue_handler.setFormatter(logging.Formatter("%(message)s"))
+logging.basicConfig(
+    level=logging.DEBUG if DEBUG_MODE else logging.INFO,
+    handlers=[queue_handler]
+)
+log_listener.start()
+atexit.register(log_listener.stop)
+logger = logging.getLogger(__name__)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    yield
+    # Each resource is released in reverse order, including when a later one fails to start
+    async with AsyncExitStack() as stack:
+        await init_job_store()
+        stack.push_async_callback(close_job_store)
+        await start_render_pool()
+        stack.push_async_callback(asyncio.to_thread, shutdown_render_pool)
+        start_job_workers(process_video_job)
+        stack.push_async_callback(stop_job_workers)
+        yield
 
-app = FastAPI(lifespan=lifespan)
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -33,166 +79,270 @@ app.add_middleware(
     allow_headers=["Content-Type", "Range"],
 )
 
+class SelectiveGZipMiddleware:
+    """
+    Gzip responses, except under paths whose bodies must pass through untouched:
+    video bytes and downloads (already compressed, and range requests address raw offsets)
+    and event streams (the compressor would hold events back until its buffer fills).
+    """
+    def __init__(self, app, minimum_size: int = 500, excluded_prefixes: tuple = ()):
+        self.app = app
+        self.gzip_app = GZipMiddleware(app, minimum_size=minimum_size)
+        self.excluded_prefixes = excluded_prefixes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and not scope["path"].startswith(self.excluded_prefixes):
+            await self.gzip_app(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+app.add_middleware(
+    SelectiveGZipMiddleware,
+    minimum_size=500,
+    excluded_prefixes=("/videos/", "/download/", "/job-status-stream/")
+)
+
 # Constants
 VIDEOS_DIR = Path("videos")
 VIDEOS_DIR.mkdir(exist_ok=True)
+SAFE_VIDEO_FILENAME = re.compile(r"[A-Za-z0-9._-]{1,128}\.mp4")
+MAX_JOB_STATUS_WAIT_SECONDS = 60.0
+# Idle event streams get a comment line this often so proxies don't time them out during long renders
+SSE_KEEPALIVE_SECONDS = 15.0
+# Internal nginx location for videos; when set, nginx serves video bytes instead of the API
+VIDEOS_ACCEL_REDIRECT_PREFIX = os.getenv("VIDEOS_ACCEL_REDIRECT_PREFIX")
 
 # Remove StaticFiles mount and add streaming endpoint
 @app.get("/videos/{video_filename}")
 async def stream_video(video_filename: str, request: Request):
     """Stream video with support for range requests"""
+    if not SAFE_VIDEO_FILENAME.fullmatch(video_filename):
+        raise HTTPException(status_code=404, detail="Video not found")
     video_path = VIDEOS_DIR / video_filename
     
+    if VIDEOS_ACCEL_REDIRECT_PREFIX:
+        return Response(headers=get_accel_redirect_headers(video_path, VIDEOS_ACCEL_REDIRECT_PREFIX))
+    
     range_header = request.headers.get("range")
-    response_data = get_video_file_response(video_path, range_header)
+    response_data = await asyncio.to_thread(get_video_file_response, video_path, range_header)
+    
+    if not response_data.content_range:
+        # FileResponse sends the file in chunks instead of loading it into memory
+        return FileResponse(
+            video_path,
+            media_type=response_data.content_type,
+            headers={"accept-ranges": response_data.accept_ranges}
+        )
     
-    # Prepare headers
     headers = {
         "accept-ranges": response_data.accept_ranges,
         "content-type": response_data.content_type,
-        "content-length": str(response_data.content_length)
+        "content-length": str(response_data.content_length),
+        "content-range": response_data.content_range
     }
-    
-    if response_data.content_range:
-        headers["content-range"] = response_data.content_range
-        
-        # Parse start and chunk size from content range
-        start = int(response_data.content_range.split(" ")[1].split("-")[0])
-        chunk_size = response_data.content_length
-        content = read_video_chunk(video_path, start, chunk_size)
-    else:
-        content = read_video_chunk(video_path)
-    
-    return Response(
-        content=content,
+    return StreamingResponse(
+        iter_video_chunks(video_path, response_data.range_start, response_data.content_length),
         status_code=response_data.status_code,
         headers=headers
     )
 
+@app.get("/download/{video_filename}")
+async def download_video(video_filename: str):
+    """Download a video as an attachment; nginx sends the bytes when X-Accel-Redirect is configured"""
+    if not SAFE_VIDEO_FILENAME.fullmatch(video_filename):
+        raise HTTPException(status_code=404, detail="Video not found")
+    video_path = VIDEOS_DIR / video_filename
+    content_disposition = f'attachment; filename="{video_filename}"'
+    
+    if VIDEOS_ACCEL_REDIRECT_PREFIX:
+        headers = get_accel_redirect_headers(video_path, VIDEOS_ACCEL_REDIRECT_PREFIX)
+        headers["content-disposition"] = content_disposition
+        return Response(headers=headers)
+    
+    if not video_path.is_file():
+        raise HTTPException(status_code=404, detail="Video not found")
+    return FileResponse(video_path, media_type="video/mp4", headers={"content-disposition": content_disposition})
+
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
 
+def job_status_response(job_status: JobMetadata) -> Response:
+    """Serialize job metadata straight to JSON, skipping the intermediate dict of the default response"""
+    return Response(content=job_status.model_dump_json(), media_type="application/json")
+
 @app.get("/job-status/{job_id}")
 async def get_job_status(job_id: str):
     """Endpoint to get job status"""
-    print(f"=== DEBUG: Checking status for job {job_id} ===")
-    if job_id not in jobs:
-        print(f"=== ERROR: Job {job_id} not found in jobs dictionary ===")
-        print(f"=== DEBUG: Current jobs: {list(jobs.keys())} ===")
+    logger.debug("Checking status for job %s", job_id)
+    job_status = await get_job(job_id)
+    if job_status is None:
+        logger.error("Job %s not found in job store", job_id)
         raise HTTPException(status_code=404, detail="Job not found")
-    job_status = jobs[job_id]
-    print(f"=== DEBUG: Returning status for job {job_id}: {job_status} ===")
-    return job_status
+    logger.debug("Returning status for job %s: %s", job_id, job_status)
+    return job_status_response(job_status)
+
+@app.get("/job-status-wait/{job_id}")
+async def wait_for_job_status(
+    job_id: str,
+    timeout: float = Query(25.0, gt=0, le=MAX_JOB_STATUS_WAIT_SECONDS)
+):
+    """Long-poll endpoint: return the job status once it changes or the timeout elapses"""
+    # The same subscription as the event stream, so with Redis an update from any worker wakes the poll
+    updates = iter_job_updates(job_id)
+    try:
+        try:
+            job_status, _ = await anext(updates)
+        except StopAsyncIteration:
+            raise HTTPException(status_code=404, detail="Job not found")
+        if job_status.status in FINISHED_JOB_STATUSES:
+            return job_status_response(job_status)
+
+        try:
+            job_status, _ = await asyncio.wait_for(anext(updates), timeout=timeout)
+        except (asyncio.TimeoutError, StopAsyncIteration):
+            # The snapshot read before waiting may be stale by now
+            job_status = await get_job(job_id) or job_status
+        return job_status_response(job_status)
+    finally:
+        await updates.aclose()
+
+@app.get("/job-status-stream/{job_id}")
+async def stream_job_status(job_id: str):
+    """Server-sent events endpoint that pushes every job status change until the job finishes"""
+    if await get_job(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def event_stream():
+        updates = iter_job_updates(job_id)
+        # The pending read survives keepalive timeouts; cancelling it would close the update iterator
+        next_update = asyncio.ensure_future(anext(updates))
+        try:
+            while True:
+                done, _ = await asyncio.wait({next_update}, timeout=SSE_KEEPALIVE_SECONDS)
+                if not done:
+                    yield ": keepalive\n\n"
+                    continue
+                try:
+                    _, payload = next_update.result()
+                except StopAsyncIteration:
+                    break
+                yield f"data: {payload}\n\n"
+                next_update = asyncio.ensure_future(anext(updates))
+        finally:
+            if not next_update.done():
+                # Let the cancelled read unwind before closing the iterator it is running
+                next_update.cancel()
+                await asyncio.wait({next_update})
+            await updates.aclose()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"cache-control": "no-cache", "x-accel-buffering": "no"}
+    )
 
 async def validate_request(texts: List[str], audio_files: List[UploadFile]):
     """Validate the incoming request data"""
     if len(texts) != len(audio_files):
         raise HTTPException(status_code=400, detail="Number of texts must match number of audio files")
 
-def cleanup_temp_files(temp_files: List[str]):
-    """Clean up temporary files"""
-    for temp_file in temp_files:
-        try:
-            Path(temp_file).unlink()
-        except Exception:
-            pass
+async def cleanup_temp_files(temp_files: List[str]):
+    """Clean up temporary files concurrently in worker threads, ignoring failures"""
+    await asyncio.gather(
+        *(asyncio.to_thread(Path(temp_file).unlink) for temp_file in temp_files),
+        return_exceptions=True
+    )
+
+async def update_progress(job_id: str, progress: int, status: JobStatus = JobStatus.IN_PROGRESS):
+    """Update a job's progress; bound to a job ID with partial and passed down the pipeline"""
+    await update_job(job_id, status, progress)
 
 async def process_video_job(
     job_id: str,
     user_query: str,
     is_pro: bool
 ):
-    """Background task to process the video generation job"""
-
-    # Keeping isPro in the method signature; will be used later when o3-mini designs a full video plan.
-    async def update_progress(progress: int, status: JobStatus = JobStatus.IN_PROGRESS):
-        """Helper function to update job progress with sufficient sleep time"""
-        jobs[job_id].status = status
-        jobs[job_id].progress = progress
-        await asyncio.sleep(0.5)
+    """Process a queued video generation job"""
+    job_progress = partial(update_progress, job_id)
     
     try:
-        print(f"=== DEBUG: Starting video generation job {job_id} ===")
+        logger.debug("Starting video generation job %s", job_id)
         
         # Prepare initial prerequisites (content and script)
         video_plan = await prepare_video_prerequisites(
-            user_query, update_progress
+            user_query, job_progress
         )
         
         # Generate and render the video
         video_filename = await generate_and_render_video(
             video_plan,
-            update_progress
+            job_id,
+            job_progress,
+            is_pro
         )
         
         # Update job status
-        print(f"=== DEBUG: Video generation complete, updating job status for {job_id} ===")
-        jobs[job_id].status = JobStatus.COMPLETED
-        jobs[job_id].progress = 100
-        jobs[job_id].videoUrl = video_filename
-        print(f"=== DEBUG: Job {job_id} completed successfully with video: {video_filename} ===")
+        logger.debug("Video generation complete, updating job status for %s", job_id)
+        await update_job(job_id, JobStatus.COMPLETED, 100, video_url=video_filename)
+        logger.info("Job %s completed successfully with video: %s", job_id, video_filename)
         
     except Exception as e:
-        print(f"=== ERROR: Exception in video generation job {job_id}: {str(e)} ===")
-        if job_id in jobs:  # Check if job still exists
-            jobs[job_id].status = JobStatus.FAILED
-            jobs[job_id].progress = 0
+        logger.exception("Exception in video generation job %s: %s", job_id, e)
+        await update_job(job_id, JobStatus.FAILED, 0)
+        raise
+    except asyncio.CancelledError:
+        # Cancelled on shutdown; the job will not be resumed, so don't leave it in progress
+        logger.warning("Video generation job %s cancelled", job_id)
+        await update_job(job_id, JobStatus.FAILED, 0)
         raise
     finally:
-        print(f"=== DEBUG: Video generation process complete for job {job_id} ===")
-        # Add a small delay to ensure the job status is updated before any potential cleanup
-        await asyncio.sleep(1)
+        logger.debug("Video generation process complete for job %s", job_id)
 
 @app.post("/generate-video")
-async def generate_video(
-    background_tasks: BackgroundTasks,
-    request: VideoRequest
-):
+async def generate_video(request: VideoRequest):
     """Start a video generation job, immediately return a job ID so the frontend can poll for status"""
     try:
         job_id = str(uuid4())
-        print(f"=== DEBUG: Creating new video generation job {job_id} ===")
-        jobs[job_id] = JobMetadata(
-            job_id=job_id,
-            status=JobStatus.PENDING,
-            progress=0
-        )
+        logger.debug("Creating new video generation job %s", job_id)
+        await create_job(job_id)
 
-        print(f"=== DEBUG: Starting video generation for query: {request.query} ===")
+        logger.debug("Starting video generation for query: %s", request.query)
 
-        background_tasks.add_task(
-            process_video_job,
-            job_id=job_id,
-            user_query=request.query,
-            is_pro=request.is_pro
-        )
+        await enqueue_job(job_id, request.query, request.is_pro)
         
         return {"job_id": job_id}
         
     except Exception as e:
-        print(f"=== ERROR: Exception in generate_video: {str(e)} ===")
+        logger.exception("Exception in generate_video: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.api_route("/delete/videos", methods=["POST", "DELETE"])
-async def delete_videos(filenames: List[str] = Body(...)):
+def delete_video_files(filenames: List[str]) -> List[dict]:
+    """Delete the named videos, returning a result per filename"""
     results = []
-    for filename in filenames:
-        if "/" in filename or "\\" in filename:
-            results.append({"filename": filename, "status": "error", "message": "Invalid filename"})
-            continue
-            
-        video_path = VIDEOS_DIR / filename
-        try:
-            if not video_path.exists():
-                results.append({"filename": filename, "status": "error", "message": "File not found"})
+    # Open the videos directory once and unlink relative to it, so each delete is a single unlinkat
+    videos_dir_fd = os.open(VIDEOS_DIR, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        for filename in filenames:
+            if not SAFE_VIDEO_FILENAME.fullmatch(filename):
+                results.append({"filename": filename, "status": "error", "message": "Invalid filename"})
                 continue
                 
-            video_path.unlink()
-            results.append({"filename": filename, "status": "success", "message": "Deleted"})
-            
-        except Exception as e:
-            print(f"=== ERROR: Failed to delete video {filename}: {e} ===")
-            results.append({"filename": filename, "status": "error", "message": str(e)})
+            try:
+                os.unlink(filename, dir_fd=videos_dir_fd)
+                results.append({"filename": filename, "status": "success", "message": "Deleted"})
+            except FileNotFoundError:
+                results.append({"filename": filename, "status": "error", "message": "File not found"})
+            except Exception as e:
+                logger.error("Failed to delete video %s: %s", filename, e)
+                results.append({"filename": filename, "status": "error", "message": str(e)})
+    finally:
+        os.close(videos_dir_fd)
     
+    return results
+
+@app.api_route("/delete/videos", methods=["POST", "DELETE"])
+async def delete_videos(filenames: List[str] = Body(...)):
+    # The whole batch runs in one worker thread so the unlinks never block the event loop
+    results = await asyncio.to_thread(delete_video_files, filenames)
     return {"results": results}
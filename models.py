@@ -32,6 +32,7 @@ class VideoStreamResponse(BaseModel):
     content_type: str
     content_length: int
     content_range: Optional[str] = None
+    range_start: Optional[int] = None
     accept_ranges: str = "bytes"
     status_code: int = 200
 
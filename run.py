@@ -5,5 +5,7 @@ if __name__ == "__main__":
         "main:app",
         host="0.0.0.0",
         port=8000,
+        loop="uvloop",
+        http="httptools",
         reload=False  # Disable auto-reload to prevent server restarts
     )
@@ -1,18 +1,23 @@
 from pathlib import Path
-from typing import Tuple, List, Dict, Any
-from uuid import uuid4
+from typing import Tuple, List, Dict, Any, Set, Final, Optional, Callable, Awaitable
 import tempfile
 import subprocess
 import shutil
 import os
+import logging
+import ast
+import importlib.util
+import traceback
 from dotenv import load_dotenv
 from fastapi import HTTPException
 import multiprocessing
 from itertools import cycle
 import asyncio
 from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 from audio.audio_utils import generate_audio
+from files.file_utils import write_file_atomic
 from ai.ai_utils import generate_video_plan, generate_manim_scenes, retry_manim_scene_generation
 from models import VideoPlan
 
@@ -20,12 +25,37 @@ from models import VideoPlan
 load_dotenv()
 
 # Debug mode setting
-DEBUG_MODE = os.getenv("DEBUG_MODE", "false").lower() == "true"
+DEBUG_MODE: Final[bool] = os.getenv("DEBUG_MODE", "false").lower() == "true"
+
+logger = logging.getLogger(__name__)
 
 # Constants
 VIDEOS_DIR = Path("videos")
 AUDIO_DIR = Path("audio")
 DEBUG_DIR = Path("debug")
+# Parent of the per-job work directories; point it at tmpfs to keep render scratch files off disk
+RENDER_WORK_DIR = Path(os.getenv("RENDER_WORK_DIR", Path(tempfile.gettempdir()) / "teacherflow"))
+RENDER_WORK_DIR.mkdir(parents=True, exist_ok=True)
+if DEBUG_MODE:
+    DEBUG_DIR.mkdir(exist_ok=True)
+# Number of API worker processes on this host, exported by gunicorn_conf; each one runs its own
+# render pool, so the host's cores are divided between them
+WEB_CONCURRENCY = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+# Use N-1 cores to leave one free for system processes
+RENDER_WORKERS = max(1, int(os.getenv("RENDER_WORKERS", (multiprocessing.cpu_count() - 1) // WEB_CONCURRENCY)))
+# Manim quality presets: 480p15 renders several times faster than 720p30, so only pro videos get the latter
+DEFAULT_RENDER_QUALITY = "low_quality"
+PRO_RENDER_QUALITY = "medium_quality"
+
+# Process pool shared by all jobs, so concurrent jobs queue scenes instead of each forking their own pool
+render_pool: Optional[ProcessPoolExecutor] = None
+
+# Bound the number of jobs rendering at once so concurrent Manim renders don't thrash the CPU or exhaust memory
+MAX_CONCURRENT_RENDERS = int(os.getenv("MAX_CONCURRENT_RENDERS", max(1, (os.cpu_count() or 2) // 2 // WEB_CONCURRENCY)))
+RENDER_SEMAPHORE = asyncio.BoundedSemaphore(MAX_CONCURRENT_RENDERS)
+
+# Strong references to in-flight temp directory cleanups so they are not garbage collected
+cleanup_tasks: Set[asyncio.Task] = set()
 
 async def prepare_video_prerequisites(
     user_query: str,
@@ -35,13 +65,13 @@ async def prepare_video_prerequisites(
     Prepare initial prerequisites for video generation including content and script.
     Returns VideoPlan object (without audio information at this stage).
     """
-    print("=== DEBUG: Step 1 - Generating video plan ===")
+    logger.debug("Step 1 - Generating video plan")
     await update_progress(10)
     messages = [{"role": "user", "content": user_query}]
-    video_plan_response = generate_video_plan(messages)
+    video_plan_response = await asyncio.to_thread(generate_video_plan, messages)
     json_content = video_plan_response["message"]["content"]
     
-    print("=== DEBUG: Step 2 - Parsing video plan ===")
+    logger.debug("Step 2 - Parsing video plan")
     await update_progress(20)
     video_plan = VideoPlan.model_validate_json(json_content)
     
@@ -53,13 +83,12 @@ def analyze_parallel_distribution(scenes):
     Analyze and log how scenes would be distributed across available CPU cores.
     """
     total_cores = multiprocessing.cpu_count()
-    # Use N-1 workers to leave one core free for system processes
-    num_workers = max(1, total_cores - 1)
+    num_workers = RENDER_WORKERS
     
-    print(f"\n=== Parallel Processing Analysis ===")
-    print(f"Total CPU cores available: {total_cores}")
-    print(f"Number of worker processes: {num_workers}")
-    print(f"Total scenes to process: {len(scenes)}")
+    logger.debug("Parallel processing analysis")
+    logger.debug("Total CPU cores available: %d", total_cores)
+    logger.debug("Number of worker processes: %d", num_workers)
+    logger.debug("Total scenes to process: %d", len(scenes))
     
     # Simulate distribution of scenes to workers
     workers = list(range(num_workers))
@@ -68,10 +97,9 @@ def analyze_parallel_distribution(scenes):
     for scene_idx, worker in zip(range(len(scenes)), cycle(workers)):
         scene_distribution[worker].append(scene_idx + 1)
     
-    print("\nProjected scene distribution:")
+    logger.debug("Projected scene distribution:")
     for worker_id, scene_list in scene_distribution.items():
-        print(f"Worker {worker_id + 1}: Scenes {scene_list} ({len(scene_list)} scenes)")
-    print("===================================\n")
+        logger.debug("Worker %d: Scenes %s (%d scenes)", worker_id + 1, scene_list, len(scene_list))
 
 def render_single_scene(scene_data: Dict[str, Any]) -> List[Path]:
     """
@@ -81,9 +109,7 @@ def render_single_scene(scene_data: Dict[str, Any]) -> List[Path]:
     scene_idx = scene_data['scene_idx']
     scene_code = scene_data['scene_code']
     temp_dir_path = Path(scene_data['temp_dir'])
-    video_id = scene_data['video_id']
     max_retries = scene_data['max_retries']
-    debug_mode = scene_data['debug_mode']
     
     # Create scene-specific directory
     worker_dir = temp_dir_path / f"worker_{scene_idx + 1}"
@@ -94,81 +120,112 @@ def render_single_scene(scene_data: Dict[str, Any]) -> List[Path]:
     
     while scene_attempt <= max_retries:
         try:
-            print(f"=== DEBUG: Rendering scene {scene_idx + 1} (attempt {scene_attempt + 1}) ===")
+            logger.debug("Rendering scene %d (attempt %d)", scene_idx + 1, scene_attempt + 1)
             
             # Write current scene code to file
             scene_file = worker_dir / f"scene_{scene_idx + 1}.py"
-            with open(scene_file, "w") as f:
-                f.write(current_code)
+            scene_file.write_bytes(current_code.encode("utf-8"))
             
-            # Render individual scene
-            cmd = ["manim", "-qm", "-a", str(scene_file)]
+            # Render individual scene in-process
             try:
-                process = subprocess.Popen(
-                    cmd,
-                    cwd=worker_dir,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    text=True,
-                    start_new_session=True
-                )
-                stdout, stderr = process.communicate()
-                if process.returncode != 0:
-                    error_msg = f"Command output (stdout):\n{stdout}\nCommand output (stderr):\n{stderr}"
-                    print(f"=== ERROR: Scene {scene_idx + 1} rendering failed on attempt {scene_attempt + 1} ===")
-                    print(error_msg)
-                    
-                    if debug_mode:
-                        save_debug_files(Path(scene_data['generation_dir']), video_id, scene_data['json_content'], 
-                                      scene_code, scene_idx + 1, scene_attempt + 1, error_msg)
-                    
-                    raise subprocess.CalledProcessError(process.returncode, cmd, stdout, stderr)
-            except subprocess.CalledProcessError as e:
+                scene_videos = render_scene_file(scene_file, worker_dir / "media", scene_data['quality'])
+            except Exception:
+                error_msg = traceback.format_exc()
+                logger.error("Scene %d rendering failed on attempt %d:\n%s", scene_idx + 1, scene_attempt + 1, error_msg)
+                
+                save_attempt_files(scene_data['generation_dir'], scene_code, scene_idx + 1,
+                                   scene_attempt + 1, error_msg)
+                
                 if scene_attempt == max_retries:
                     raise
                 
                 # Try to fix just this scene
-                fixed_code = retry_manim_scene_generation(current_code, e.stderr)
+                fixed_code = retry_manim_scene_generation(current_code, error_msg)
                 if not fixed_code:
-                    raise HTTPException(status_code=500, detail=f"Failed to fix scene {scene_idx + 1} after error")
+                    raise RuntimeError(f"Failed to fix scene {scene_idx + 1} after error")
                 
                 current_code = fixed_code
                 scene_attempt += 1
                 continue
             
-            # Find rendered video for this scene
-            scene_dir = worker_dir / "media" / "videos" / f"scene_{scene_idx + 1}" / "720p30"
-            scene_videos = sorted(list(scene_dir.glob("Scene_*.mp4")))
-            
             if not scene_videos:
-                print(f"=== ERROR: No video file found for scene {scene_idx + 1} after successful render ===")
+                logger.error("No video file found for scene %d after successful render", scene_idx + 1)
                 if scene_attempt == max_retries:
-                    raise HTTPException(status_code=500, detail=f"Scene {scene_idx + 1} rendered without errors but no video file was created")
+                    raise RuntimeError(f"Scene {scene_idx + 1} rendered without errors but no video file was created")
                 scene_attempt += 1
                 continue
             
-            print(f"=== DEBUG: Successfully rendered scene {scene_idx + 1} ===")
+            logger.debug("Successfully rendered scene %d", scene_idx + 1)
             
-            if debug_mode:
-                save_debug_files(Path(scene_data['generation_dir']), video_id, scene_data['json_content'], 
-                               current_code, scene_idx + 1, scene_attempt + 1)
+            save_attempt_files(scene_data['generation_dir'], current_code, scene_idx + 1,
+                               scene_attempt + 1)
             
-            return [(v, scene_idx) for v in scene_videos]
+            return scene_videos
             
         except Exception as e:
-            print(f"=== ERROR: Unexpected error rendering scene {scene_idx + 1}: {str(e)} ===")
+            logger.exception("Unexpected error rendering scene %d: %s", scene_idx + 1, e)
             if scene_attempt == max_retries:
-                raise
+                # The parent must unpickle whatever leaves this worker; an exception class that can't
+                # be rebuilt from its args (HTTPException, or one from the generated code) breaks the
+                # shared pool for every job, so only a plain RuntimeError is raised
+                raise RuntimeError(f"Failed to render scene {scene_idx + 1}: {type(e).__name__}: {e}") from None
             scene_attempt += 1
             continue
     
-    raise Exception(f"Failed to render scene {scene_idx + 1} after all attempts")
+    raise RuntimeError(f"Failed to render scene {scene_idx + 1} after all attempts")
+
+def get_render_pool() -> ProcessPoolExecutor:
+    """
+    Return the shared render process pool, creating it on first use.
+    """
+    global render_pool
+    if render_pool is None:
+        render_pool = ProcessPoolExecutor(max_workers=RENDER_WORKERS)
+    return render_pool
+
+def warm_render_worker():
+    """
+    Run once per render worker at startup so each worker pays the Manim import cost
+    before its first scene rather than during it.
+    """
+    import manim  # noqa: F401
 
-async def render_scenes_in_parallel(video_code, temp_dir_path: Path, video_id: str, 
-                                  generation_dir: Path, json_content: str, max_retries: int, 
-                                  debug_mode: bool) -> List[Path]:
+async def start_render_pool():
+    """
+    Create the shared render pool and start its worker processes, so the first job doesn't pay for them.
+    """
+    loop = asyncio.get_running_loop()
+    executor = get_render_pool()
+    await asyncio.gather(*(
+        loop.run_in_executor(executor, warm_render_worker)
+        for _ in range(RENDER_WORKERS)
+    ))
+    logger.debug("Started %d render workers", RENDER_WORKERS)
+
+def shutdown_render_pool():
+    """
+    Shut down the shared render pool, cancelling scenes that have not started. Called on app shutdown.
+    """
+    global render_pool
+    if render_pool is not None:
+        render_pool.shutdown(wait=True, cancel_futures=True)
+        render_pool = None
+
+def discard_render_pool(executor: ProcessPoolExecutor):
+    """
+    Drop a broken render pool (e.g. a worker was OOM-killed) so the next job starts a fresh one.
+    """
+    global render_pool
+    if render_pool is executor:
+        render_pool = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+async def render_scenes_in_parallel(video_code, temp_dir_path: Path,
+                                  generation_dir: Path, max_retries: int, quality: str,
+                                  scene_rendered: Optional[Callable[[int, int], Awaitable[None]]] = None) -> List[Path]:
     """
     Render all scenes in parallel using a process pool.
+    scene_rendered, if given, is awaited with (scenes done, total scenes) as each scene finishes.
     Returns ordered list of rendered video paths.
     """
     # Prepare scene data for parallel processing
@@ -178,28 +235,40 @@ async def render_scenes_in_parallel(video_code, temp_dir_path: Path, video_id: s
             'scene_idx': i,
             'scene_code': scene.code,
             'temp_dir': str(temp_dir_path),
-            'video_id': video_id,
             'max_retries': max_retries,
-            'debug_mode': debug_mode,
-            'generation_dir': str(generation_dir) if generation_dir else None,
-            'json_content': json_content if debug_mode else None
+            'quality': quality,
+            'generation_dir': str(generation_dir) if generation_dir else None
         }
         scene_data_list.append(scene_data)
     
-    # Create process pool and run scenes in parallel
-    num_workers = max(1, multiprocessing.cpu_count() - 1)
-    print(f"\n=== Starting parallel rendering with {num_workers} workers ===")
+    # Run scenes in parallel on the shared process pool
+    logger.debug("Starting parallel rendering with %d workers", RENDER_WORKERS)
     
     loop = asyncio.get_running_loop()
-    with ProcessPoolExecutor(max_workers=num_workers) as executor:
-        # Submit all scenes for processing
-        futures = [
-            loop.run_in_executor(executor, render_single_scene, scene_data)
-            for scene_data in scene_data_list
-        ]
-        
-        # Wait for all scenes to complete
-        results = await asyncio.gather(*futures, return_exceptions=True)
+    executor = get_render_pool()
+    scenes_done = 0
+    # Scenes finishing together would otherwise race their progress writes, which can then land
+    # out of order; one at a time, each reporting the latest count, progress never goes backwards
+    progress_lock = asyncio.Lock()
+    
+    async def render_scene(scene_data: Dict[str, Any]) -> List[Path]:
+        nonlocal scenes_done
+        scene_videos = await loop.run_in_executor(executor, render_single_scene, scene_data)
+        scenes_done += 1
+        if scene_rendered is not None:
+            async with progress_lock:
+                await scene_rendered(scenes_done, len(scene_data_list))
+        return scene_videos
+    
+    # Submit all scenes and wait for them to complete
+    results = await asyncio.gather(
+        *(render_scene(scene_data) for scene_data in scene_data_list),
+        return_exceptions=True
+    )
+    
+    # Drop a broken pool before raising any error, so the next job doesn't run on a dead pool
+    if any(isinstance(result, BrokenProcessPool) for result in results):
+        discard_render_pool(executor)
     
     # Check for any errors and flatten results
     rendered_videos = []
@@ -208,32 +277,33 @@ async def render_scenes_in_parallel(video_code, temp_dir_path: Path, video_id: s
             raise result
         rendered_videos.extend(result)
     
-    # Sort by scene index and extract just the video paths
-    rendered_videos.sort(key=lambda x: x[1])
-    return [video[0] for video in rendered_videos]
+    # gather preserves submission order, so videos are already in scene order
+    return rendered_videos
 
 async def generate_and_render_video(
     video_plan: VideoPlan,
-    update_progress: callable
+    video_id: str,
+    update_progress: callable,
+    is_pro: bool = False
 ) -> str:
     """
     Generate and render the video using Manim.
+    video_id names the output video and its debug directory; callers pass the job ID.
+    Pro videos are rendered at medium quality, others at low quality.
     Returns the filename of the generated video.
     """
-    video_id = str(uuid4())
     video_filename = f"{video_id}.mp4"
     max_retries = 2
     
-    videos_dir_path, generation_dir, temp_dir_path = setup_directories(video_id, DEBUG_MODE)
+    videos_dir_path, generation_dir, temp_dir_path = await asyncio.to_thread(setup_directories, video_id, DEBUG_MODE)
     
     try:
         if DEBUG_MODE:
             json_content = video_plan.model_dump_json(indent=2)
             json_path = generation_dir / f"{video_id}.json"
-            with open(json_path, 'w') as f:
-                f.write(json_content)
+            await asyncio.to_thread(write_file_atomic, json_path, json_content.encode("utf-8"))
         
-        print("=== DEBUG: Step 3 - Generating audio from script ===")
+        logger.debug("Step 3 - Generating audio from script")
         await update_progress(40)
         audio_dir = temp_dir_path / "media" / "audio"
         script_contents = [scene.script for scene in video_plan.plan]
@@ -245,32 +315,47 @@ async def generate_and_render_video(
             scene.audio_path = audio_file.path
             scene.audio_duration = audio_file.duration
         
-        print("=== DEBUG: Step 4 - Generating Manim scenes ===")
-        video_code = generate_manim_scenes(video_plan)
+        logger.debug("Step 4 - Generating Manim scenes")
+        video_code = await asyncio.to_thread(generate_manim_scenes, video_plan)
         if not video_code or not video_code.scenes:
             raise HTTPException(status_code=500, detail="Failed to generate Manim scenes")
 
-        # Analyze potential parallel processing distribution
-        analyze_parallel_distribution(video_code.scenes)
+        # Analyze potential parallel processing distribution; it only produces debug output
+        if logger.isEnabledFor(logging.DEBUG):
+            analyze_parallel_distribution(video_code.scenes)
         
-        # Render all scenes in parallel
-        rendered_videos = await render_scenes_in_parallel(
-            video_code, temp_dir_path, video_id, generation_dir,
-            json_content if DEBUG_MODE else None, max_retries, DEBUG_MODE
-        )
+        # Render all scenes in parallel, waiting for a render slot if too many jobs are rendering
+        async with RENDER_SEMAPHORE:
+            rendered_videos = await render_scenes_in_parallel(
+                video_code, temp_dir_path, generation_dir, max_retries,
+                PRO_RENDER_QUALITY if is_pro else DEFAULT_RENDER_QUALITY,
+                # Rendering spans progress 60-90
+                lambda done, total: update_progress(60 + 30 * done // total)
+            )
         
         # Update progress after all scenes are rendered
         await update_progress(90)
         
         # Concatenate all rendered scenes
-        rendered_video = concatenate_scenes(rendered_videos, temp_dir_path, video_filename)
-        save_final_video(rendered_video, videos_dir_path, generation_dir)
+        rendered_video = await concatenate_scenes(rendered_videos, temp_dir_path, video_filename)
+        await asyncio.to_thread(save_final_video, rendered_video, videos_dir_path, generation_dir)
         
         await update_progress(100)
         return video_filename
                 
     finally:
-        shutil.rmtree(temp_dir_path, ignore_errors=True)
+        schedule_temp_dir_cleanup(temp_dir_path)
+
+def schedule_temp_dir_cleanup(temp_dir_path: Path):
+    """
+    Remove a temporary directory in a worker thread without blocking the caller.
+    Manim leaves hundreds of partial movie files behind, so the delete can take a while.
+    """
+    cleanup_task = asyncio.create_task(
+        asyncio.to_thread(shutil.rmtree, temp_dir_path, ignore_errors=True)
+    )
+    cleanup_tasks.add(cleanup_task)
+    cleanup_task.add_done_callback(cleanup_tasks.discard)
 
 def setup_directories(video_id: str, debug_mode: bool) -> Tuple[Path, Path, Path]:
     """
@@ -283,38 +368,101 @@ def setup_directories(video_id: str, debug_mode: bool) -> Tuple[Path, Path, Path
     
     generation_dir = None
     if debug_mode:
-        DEBUG_DIR.mkdir(exist_ok=True)
         generation_dir = DEBUG_DIR / video_id
         generation_dir.mkdir(exist_ok=True)
 
-    temp_dir = tempfile.mkdtemp()
+    temp_dir = tempfile.mkdtemp(prefix=f"{video_id}-", dir=RENDER_WORK_DIR)
     temp_dir_path = Path(temp_dir)
     
-    media_dir = temp_dir_path / "media"
-    media_dir.mkdir(exist_ok=True)
-    audio_dir = media_dir / "audio"
-    audio_dir.mkdir(exist_ok=True)
+    (temp_dir_path / "media" / "audio").mkdir(parents=True)
     
     return videos_dir_path, generation_dir, temp_dir_path
 
-def save_debug_files(generation_dir: Path, video_id: str, json_content: str, manim_code: str, scene_num: int, attempt: int, error: str = None):
+def write_new_file(path: Path, content: bytes):
     """
-    Save debug files when in debug mode.
+    Create a file that must not already exist and fill it with a single write.
     """
-    json_path = generation_dir / f"{video_id}.json"
-    with open(json_path, 'w') as f:
-        f.write(json_content)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+    try:
+        os.write(fd, content)
+    finally:
+        os.close(fd)
 
+def save_debug_files(generation_dir: Path, manim_code: str, scene_num: int, attempt: int, error: str = None):
+    """
+    Save the code of a render attempt when in debug mode.
+    The video plan JSON is written once by generate_and_render_video.
+    """
+    generation_dir = Path(generation_dir)
     if error:
-        fail_file = generation_dir / f"fail-{scene_num}-{attempt}.py"
-        with open(fail_file, "w") as f:
-            f.write(manim_code)
-            f.write("\n\n# Error details from Manim rendering:\n")
-            f.write(f'error_message = """{error}"""')
+        fail_content = f'{manim_code}\n\n# Error details from Manim rendering:\nerror_message = """{error}"""'
+        write_new_file(generation_dir / f"fail-{scene_num}-{attempt}.py", fail_content.encode("utf-8"))
     else:
-        success_file = generation_dir / f"success-{scene_num}-{attempt}.py"
-        with open(success_file, "w") as f:
-            f.write(manim_code)
+        write_new_file(generation_dir / f"success-{scene_num}-{attempt}.py", manim_code.encode("utf-8"))
+
+def skip_debug_files(*args, **kwargs):
+    """
+    Stand-in for save_debug_files outside debug mode.
+    """
+
+# Resolved once at import so render attempts don't branch on DEBUG_MODE
+save_attempt_files = save_debug_files if DEBUG_MODE else skip_debug_files
+
+def get_scene_classes(tree: ast.Module, namespace: Dict[str, Any], scene_base: type) -> List[type]:
+    """
+    Return the Scene subclasses defined at the top level of an executed module, in definition order.
+    Any subclass counts, e.g. MovingCameraScene or ThreeDScene subclasses, as with `manim -a`.
+    """
+    scene_classes = []
+    for node in tree.body:
+        if not isinstance(node, ast.ClassDef):
+            continue
+        scene_class = namespace.get(node.name)
+        if isinstance(scene_class, type) and issubclass(scene_class, scene_base):
+            scene_classes.append(scene_class)
+    return scene_classes
+
+def render_scene_file(scene_file: Path, media_dir: Path, quality: str = PRO_RENDER_QUALITY) -> List[Path]:
+    """
+    Render every Scene class defined in scene_file within the current process.
+    Avoids the interpreter startup and manim import of a CLI subprocess.
+    Returns list of rendered video paths in the order the scenes are defined.
+    """
+    # Imported here so only render workers load Manim, not the API process
+    from manim import Scene, tempconfig
+
+    # Parse up front so malformed code fails before anything is executed or rendered
+    tree = ast.parse(scene_file.read_bytes(), filename=str(scene_file))
+
+    spec = importlib.util.spec_from_file_location(scene_file.stem, scene_file)
+    module = importlib.util.module_from_spec(spec)
+
+    rendered_videos = []
+    # This worker renders scenes for every job, so any config the generated code sets at
+    # module level must be rolled back once its scenes are done
+    with tempconfig({}):
+        exec(compile(tree, str(scene_file), "exec"), module.__dict__)
+        scene_classes = get_scene_classes(tree, module.__dict__, Scene)
+        if not scene_classes:
+            raise Exception(f"Could not find a Scene class in {scene_file.name}")
+
+        for scene_class in scene_classes:
+            scene_config = {
+                "quality": quality,
+                "media_dir": str(media_dir),
+                "input_file": str(scene_file),
+                # Partial movie files live in a per-job media dir and are never reused,
+                # so skip hashing every animation for Manim's cache
+                "disable_caching": True,
+            }
+            with tempconfig(scene_config):
+                scene = scene_class()
+                scene.render()
+                movie_file_path = scene.renderer.file_writer.movie_file_path
+                if movie_file_path and Path(movie_file_path).exists():
+                    rendered_videos.append(Path(movie_file_path))
+
+    return rendered_videos
 
 def render_manim_scenes(temp_dir_path: Path, manim_code: str) -> List[Path]:
     """
@@ -322,18 +470,12 @@ def render_manim_scenes(temp_dir_path: Path, manim_code: str) -> List[Path]:
     Returns list of rendered video paths.
     """
     temp_file_path = temp_dir_path / "scene.py"
-    with open(temp_file_path, "w") as f:
-        f.write(manim_code)
-
-    cmd = ["manim", "-qm", "-a", str(temp_file_path)]
-    result = subprocess.run(cmd, cwd=temp_dir_path, capture_output=True, text=True)
-    result.check_returncode()
+    temp_file_path.write_bytes(manim_code.encode("utf-8"))
 
-    video_pattern = "media/videos/**/720p30/*.mp4"
-    rendered_videos = sorted(list(Path(temp_dir_path).glob(video_pattern)))
+    rendered_videos = render_scene_file(temp_file_path, temp_dir_path / "media")
     
     if not rendered_videos:
-        raise Exception(f"Could not find any rendered videos with pattern: {video_pattern}")
+        raise Exception(f"Could not find any rendered videos for {temp_file_path.name}")
     
     return rendered_videos
 
@@ -341,14 +483,18 @@ def save_final_video(rendered_video: Path, videos_dir_path: Path, generation_dir
     """
     Save the final video to appropriate locations.
     Always saves to videos_dir_path for serving, and optionally saves to generation_dir/video_filename in debug mode.
+    The debug copy is a hardlink when both paths share a filesystem, so the video is not rewritten.
     """
+    shutil.move(str(rendered_video), str(videos_dir_path))
+    
     if generation_dir:
         debug_path = generation_dir / videos_dir_path.name
-        shutil.copy2(str(rendered_video), str(debug_path))
-    
-    shutil.move(str(rendered_video), str(videos_dir_path))
+        try:
+            os.link(videos_dir_path, debug_path)
+        except OSError:
+            shutil.copy2(str(videos_dir_path), str(debug_path))
 
-def concatenate_scenes(
+async def concatenate_scenes(
     rendered_videos: list[Path],
     temp_dir_path: Path,
     video_filename: str
@@ -358,17 +504,15 @@ def concatenate_scenes(
     If multiple videos exist, they will be concatenated using ffmpeg.
     If only one video exists, it will be renamed to the desired filename.
     """
-    print(f"=== DEBUG: Concatenating {len(rendered_videos)} videos ===")
-    for i, video in enumerate(rendered_videos):
-        print(f"Video {i + 1}: {video.name}")
+    logger.debug("Concatenating %d videos", len(rendered_videos))
+    if logger.isEnabledFor(logging.DEBUG):
+        for i, video in enumerate(rendered_videos):
+            logger.debug("Video %d: %s", i + 1, video.name)
     
     concat_file = temp_dir_path / "concat.txt"
-    print(f"=== DEBUG: Writing concat file to: {concat_file} ===")
-    with open(concat_file, "w") as f:
-        for video in rendered_videos:
-            line = f"file '{video.absolute()}'"
-            print(f"=== DEBUG: Adding to concat file: {line} ===")
-            f.write(f"{line}\n")
+    logger.debug("Writing concat file to: %s", concat_file)
+    concat_lines = [f"file '{video.absolute()}'\n" for video in rendered_videos]
+    await asyncio.to_thread(concat_file.write_bytes, "".join(concat_lines).encode("utf-8"))
     
     combined_video = temp_dir_path / video_filename
     concat_cmd = [
@@ -379,24 +523,25 @@ def concatenate_scenes(
         "-c", "copy",
         str(combined_video)
     ]
-    print(f"=== DEBUG: Running ffmpeg command: {' '.join(concat_cmd)} ===")
+    logger.debug("Running ffmpeg command: %s", " ".join(concat_cmd))
     
     try:
-        # Use a separate process group to prevent affecting the main server
-        process = subprocess.Popen(
-            concat_cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
+        # Use a separate process group to prevent affecting the main server, and await it without blocking the event loop
+        process = await asyncio.create_subprocess_exec(
+            *concat_cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
             start_new_session=True  # This prevents the subprocess from sharing signal handlers
         )
-        stdout, stderr = process.communicate()
+        stdout, stderr = await process.communicate()
         if process.returncode != 0:
-            print(f"=== ERROR: ffmpeg concat failed ===\nStdout:\n{stdout}\nStderr:\n{stderr}")
-            raise subprocess.CalledProcessError(process.returncode, concat_cmd, stdout, stderr)
-        print(f"=== DEBUG: Successfully created combined video: {combined_video} ===")
+            raise subprocess.CalledProcessError(
+                process.returncode, concat_cmd,
+                stdout.decode(errors="replace"), stderr.decode(errors="replace")
+            )
+        logger.debug("Successfully created combined video: %s", combined_video)
     except subprocess.CalledProcessError as e:
-        print(f"=== ERROR: ffmpeg concat failed ===\nStdout:\n{e.stdout}\nStderr:\n{e.stderr}")
+        logger.error("ffmpeg concat failed\nStdout:\n%s\nStderr:\n%s", e.stdout, e.stderr)
         raise
     
     return combined_video
@@ -1,6 +1,7 @@
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Dict, AsyncIterator
 from fastapi import HTTPException
+import asyncio
 from models import VideoStreamResponse
 
 def get_video_file_response(video_path: Path, range_header: Optional[str] = None) -> VideoStreamResponse:
@@ -40,29 +41,57 @@ def get_video_file_response(video_path: Path, range_header: Optional[str] = None
             content_type="video/mp4",
             content_length=chunk_size,
             content_range=f"bytes {start}-{end}/{file_size}",
+            range_start=start,
             status_code=206
         )
     except (ValueError, IndexError):
         raise HTTPException(status_code=416, detail="Invalid range header")
 
-def read_video_chunk(video_path: Path, start: int = 0, chunk_size: Optional[int] = None) -> bytes:
+def get_accel_redirect_headers(video_path: Path, redirect_prefix: str) -> Dict[str, str]:
     """
-    Read a chunk of video file from the specified start position.
+    Build headers that hand the video off to nginx via X-Accel-Redirect.
+    nginx then serves the bytes (including range requests) with sendfile instead of Python.
     
     Args:
         video_path: Path to the video file
-        start: Starting byte position
-        chunk_size: Number of bytes to read (None for entire file)
+        redirect_prefix: Internal nginx location that aliases the videos directory
         
     Returns:
-        Bytes of the video chunk
+        Response headers for the redirect
+    """
+    if not video_path.is_file():
+        raise HTTPException(status_code=404, detail="Video not found")
+    
+    return {
+        "x-accel-redirect": f"{redirect_prefix.rstrip('/')}/{video_path.name}",
+        "content-type": "video/mp4"
+    }
+
+# Size of each read when streaming a byte range
+VIDEO_STREAM_CHUNK_SIZE = 1024 * 1024
+
+async def iter_video_chunks(video_path: Path, start: int, length: int) -> AsyncIterator[bytes]:
     """
-    if chunk_size is None:
-        return video_path.read_bytes()
+    Yield a byte range of a video file in chunks, reading in a worker thread,
+    so at most one chunk of the range is held in memory.
+    
+    Args:
+        video_path: Path to the video file
+        start: Starting byte position
+        length: Number of bytes to send
         
+    Yields:
+        Successive chunks of the range
+    """
+    video = await asyncio.to_thread(open, video_path, "rb")
     try:
-        with open(video_path, "rb") as video:
-            video.seek(start)
-            return video.read(chunk_size)
-    except (IOError, OSError) as e:
-        raise HTTPException(status_code=500, detail="Error reading video file") from e
+        await asyncio.to_thread(video.seek, start)
+        remaining = length
+        while remaining > 0:
+            chunk = await asyncio.to_thread(video.read, min(VIDEO_STREAM_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        video.close()